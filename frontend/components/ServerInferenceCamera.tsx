@@ -103,24 +103,29 @@ const ServerInferenceCamera = (props: ServerInferenceCameraProps) => {
   const sendFrameToServer = async (ctx: CanvasRenderingContext2D): Promise<ServerResponse | null> => {
     try {
       const canvas = ctx.canvas;
-      const imageData = canvas.toDataURL('image/jpeg', 0.8);
+      const imageBlob = await new Promise<Blob | null>((resolve) =>
+        canvas.toBlob(resolve, 'image/jpeg', 0.8)
+      );
+      if (!imageBlob) {
+        throw new Error('Failed to encode frame');
+      }
       const frameId = `frame_${frameCounter.current++}`;
       const captureTs = Date.now();
 
-      const payload = {
+      const params = new URLSearchParams({
         frame_id: frameId,
-        capture_ts: captureTs,
-        image_data: imageData,
+        capture_ts: String(captureTs),
         model_name: props.modelName,
-        resolution: modelResolution
-      };
+        width: String(modelResolution[0]),
+        height: String(modelResolution[1])
+      });
 
-      const response = await fetch(`${props.serverUrl}/api/detect`, {
+      const response = await fetch(`${props.serverUrl}/api/detect_raw?${params}`, {
         method: 'POST',
         headers: {
-          'Content-Type': 'application/json',
+          'Content-Type': 'image/jpeg',
         },
-        body: JSON.stringify(payload)
+        body: imageBlob
       });
 
       if (!response.ok) {
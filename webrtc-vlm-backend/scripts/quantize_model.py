@@ -0,0 +1,105 @@
+"""
+Quantize a YOLO ONNX model to INT8 using frames from a video or image folder for calibration.
+
+Usage:
+    python scripts/quantize_model.py src/models/yolov10n.onnx --calibration webcam.mp4
+    python scripts/quantize_model.py src/models/yolov10n.onnx --calibration frames/ --num-frames 100
+
+The quantized model is written next to the input as <name>_int8.onnx, which the
+backend picks up automatically in place of the FP32 model.
+"""
+import os
+import sys
+import argparse
+import cv2
+import onnxruntime as ort
+from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+from onnxruntime.quantization.shape_inference import quant_pre_process
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.utils.onnx_session import int8_model_path
+from src.utils.preprocess import letterbox
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+def read_frames(source, num_frames):
+    """Yield up to num_frames BGR frames from a video file, camera index or image folder"""
+    if os.path.isdir(source):
+        files = sorted(f for f in os.listdir(source) if f.lower().endswith(IMAGE_EXTENSIONS))
+        for file in files[:num_frames]:
+            image = cv2.imread(os.path.join(source, file), cv2.IMREAD_COLOR)
+            if image is not None:
+                yield image
+        return
+    
+    capture = cv2.VideoCapture(int(source) if source.isdigit() else source)
+    try:
+        count = 0
+        while count < num_frames:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            yield frame
+            count += 1
+    finally:
+        capture.release()
+
+class FrameCalibrationReader(CalibrationDataReader):
+    """Feeds frames to the static quantizer, preprocessed exactly like the inference routes"""
+    def __init__(self, input_name, source, num_frames, input_size):
+        self.input_name = input_name
+        self.input_size = input_size
+        self.inputs = iter([self.preprocess(frame) for frame in read_frames(source, num_frames)])
+
+    def preprocess(self, frame):
+        # Same path as preprocess_bytes: letterbox with gray padding, then blobFromImage without re-resizing
+        padded, _, _ = letterbox(frame, self.input_size)
+        input_tensor = cv2.dnn.blobFromImage(padded, scalefactor=1.0 / 255.0, size=(0, 0), mean=(0, 0, 0), swapRB=True, crop=False)
+        return {self.input_name: input_tensor}
+
+    def get_next(self):
+        return next(self.inputs, None)
+
+def main():
+    parser = argparse.ArgumentParser(description='Quantize a YOLO ONNX model to INT8')
+    parser.add_argument('model', help='Path to the FP32 ONNX model')
+    parser.add_argument('--calibration', required=True, help='Video file, camera index or folder of images')
+    parser.add_argument('--num-frames', type=int, default=100, help='Number of calibration frames [default: 100]')
+    parser.add_argument('--size', type=int, default=640, help='Model input size [default: 640]')
+    parser.add_argument('--output', help='Output path [default: <model>_int8.onnx]')
+    args = parser.parse_args()
+    
+    output_path = args.output or int8_model_path(args.model)
+    root, ext = os.path.splitext(output_path)
+    preprocessed_path = f"{root}_prep{ext or '.onnx'}"
+    
+    try:
+        # Graph cleanup recommended before static quantization. Symbolic shape inference is skipped
+        # because the bundled models have dynamic batch/height/width and it can't complete on them
+        quant_pre_process(args.model, preprocessed_path, skip_symbolic_shape=True)
+        
+        input_name = ort.InferenceSession(preprocessed_path, providers=['CPUExecutionProvider']).get_inputs()[0].name
+        reader = FrameCalibrationReader(input_name, args.calibration, args.num_frames, (args.size, args.size))
+        
+        print(f"Quantizing {args.model} -> {output_path}")
+        quantize_static(
+            preprocessed_path,
+            output_path,
+            reader,
+            quant_format=QuantFormat.QDQ,
+            per_channel=True,
+            weight_type=QuantType.QInt8,
+            activation_type=QuantType.QUInt8
+        )
+    finally:
+        # Don't leave the intermediate model behind, /models would list it as selectable
+        if os.path.exists(preprocessed_path):
+            os.remove(preprocessed_path)
+    
+    fp32_size = os.path.getsize(args.model) / 1e6
+    int8_size = os.path.getsize(output_path) / 1e6
+    print(f"Done: {fp32_size:.1f} MB -> {int8_size:.1f} MB")
+
+if __name__ == '__main__':
+    main()
@@ -5,22 +5,27 @@ import json
 import time
 import threading
 from datetime import datetime
-import cv2
 import numpy as np
 from PIL import Image
-import onnxruntime as ort
 
 # DON'T CHANGE THIS !!!
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
-from flask import Flask, send_from_directory, request, jsonify
-from flask_socketio import SocketIO, emit, disconnect
+import socketio
+import uvicorn
+from asgiref.wsgi import WsgiToAsgi
+from flask import Flask, send_from_directory, jsonify
 from flask_cors import CORS
 from aiortc import RTCPeerConnection, RTCSessionDescription, VideoStreamTrack
 from aiortc.contrib.media import MediaPlayer
 from src.models.user import db
 from src.routes.user import user_bp
-from src.routes.webrtc import webrtc_bp
+from src.routes.webrtc import webrtc_bp, set_signaling_loop
+from src.routes.inference import inference_bp
+from src.utils import fast_json
+from src.utils.metrics import P2Quantile, EmaRate
+from src.utils.onnx_session import get_session, create_io_binding, get_io_names, run_session, onnx_executor
+from src.utils.preprocess import letterbox, preprocess_kernel, warmup_preprocess
 
 app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
 app.config['SECRET_KEY'] = 'asdf#FGSgvasgf$5$WGT'
@@ -28,11 +33,28 @@ app.config['SECRET_KEY'] = 'asdf#FGSgvasgf$5$WGT'
 # Enable CORS for all routes
 CORS(app, origins="*")
 
-# Initialize SocketIO
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode='eventlet')
+# Initialize SocketIO (ASGI mode, sharing the server's event loop with aiortc)
+sio = socketio.AsyncServer(async_mode='asgi', cors_allowed_origins="*", json=fast_json)
+
+# Minimum seconds between Socket.IO emits per track
+METRICS_EMIT_INTERVAL = 0.2
+DETECTION_EMIT_INTERVAL = 0.1
+
+# Emits are queued from the tracks and sent by a background task; beyond this size they're dropped
+EMIT_QUEUE_SIZE = 256
+
+# Detection cadence adapts to observed inference latency, never faster than MAX_DETECTION_FPS
+MAX_DETECTION_FPS = 30
+INFER_PERIOD_HEADROOM = 1.2
+INFER_LATENCY_ALPHA = 0.2
+
+# Placeholder detections for the demo pipeline; set MOCK_DETECTIONS=false to disable them
+MOCK_DETECTIONS = os.environ.get('MOCK_DETECTIONS', 'true').lower() == 'true'
+MOCK_LABELS = ["person", "car", "bicycle", "dog", "cat", "bottle", "chair"]
 
 app.register_blueprint(user_bp, url_prefix='/api')
 app.register_blueprint(webrtc_bp, url_prefix='/api/webrtc')
+app.register_blueprint(inference_bp, url_prefix='/api')
 
 # Database configuration (commented out for now)
 # app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(os.path.dirname(__file__), 'database', 'app.db')}"
@@ -45,6 +67,125 @@ app.register_blueprint(webrtc_bp, url_prefix='/api/webrtc')
 peer_connections = {}
 detection_sessions = {}
 metrics_data = {}
+batch_workers = {}
+emit_queue = asyncio.Queue(maxsize=EMIT_QUEUE_SIZE)
+
+def queue_emit(event, payload, room):
+    """
+    Hand a Socket.IO emit to the drain task without blocking the caller
+    """
+    try:
+        emit_queue.put_nowait((event, payload, room))
+    except asyncio.QueueFull:
+        # Drop metrics/detections rather than back-pressure the video frames
+        pass
+
+async def drain_emit_queue():
+    while True:
+        event, payload, room = await emit_queue.get()
+        try:
+            await sio.emit(event, payload, room=room)
+        except Exception as e:
+            print(f"Error emitting {event}: {e}")
+
+class BatchInferenceWorker:
+    """
+    Collects preprocessed frames from all detection tracks and runs them
+    through a shared ONNX session as one batch
+    """
+    def __init__(self, onnx_session, max_batch=16, timeout=0.005):
+        self.onnx_session = onnx_session
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self.input_name, self.output_names = get_io_names(onnx_session)
+        self.io_binding = create_io_binding(onnx_session)
+        
+        # Only batch models whose outputs share the input's dynamic batch axis. Others (e.g. yolov7-tiny:
+        # static [1, 3, H, W] input, [num_detections, 7] output) run one frame per call, unsliced
+        batch_dim = onnx_session.get_inputs()[0].shape[0]
+        self.batch_major = isinstance(batch_dim, str) and all(
+            output.shape and output.shape[0] == batch_dim for output in onnx_session.get_outputs()
+        )
+        if not self.batch_major:
+            self.max_batch = 1
+        
+        self.loop = None
+        self.queue = None
+        self.task = None
+
+    async def submit(self, img_chw):
+        """
+        Queue a (3, H, W) float32 frame and wait for its own outputs
+        """
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            # Bind the queue and the worker coroutine to the loop the tracks run on
+            self.loop = loop
+            self.queue = asyncio.Queue()
+            self.task = loop.create_task(self.run())
+        
+        future = loop.create_future()
+        await self.queue.put((img_chw, future))
+        return await future
+
+    async def gather_up_to(self):
+        """
+        Wait for one frame, then keep collecting until the batch is full or the timeout expires
+        """
+        items = [await self.queue.get()]
+        deadline = self.loop.time() + self.timeout
+        while len(items) < self.max_batch:
+            remaining = deadline - self.loop.time()
+            if remaining <= 0:
+                break
+            try:
+                items.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return items
+
+    def infer(self, frames):
+        """
+        Run a list of frames through the session, returning a list of outputs for each frame
+        """
+        if not self.batch_major:
+            return [
+                run_session(self.onnx_session, self.input_name, self.output_names, frame[np.newaxis], self.io_binding)
+                for frame in frames
+            ]
+        
+        batch = np.ascontiguousarray(np.stack(frames), dtype=np.float32)
+        outputs = run_session(self.onnx_session, self.input_name, self.output_names, batch, self.io_binding)
+        return [[output[i:i + 1] for output in outputs] for i in range(len(frames))]
+
+    async def run(self):
+        while True:
+            items = await self.gather_up_to()
+            try:
+                # Run in a worker thread so the loop keeps receiving WebRTC packets
+                outputs = await self.loop.run_in_executor(onnx_executor, self.infer, [img for img, _ in items])
+            except Exception as e:
+                for _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            
+            for (_, future), frame_outputs in zip(items, outputs):
+                if not future.done():
+                    future.set_result(frame_outputs)
+
+async def get_batch_worker(model_path):
+    """
+    Return the shared batch worker for a model, loading its session on first use.
+    The session is built in the executor so graph optimization and the shared-session lock
+    never block the loop that aiortc and Socket.IO run on
+    """
+    if model_path not in batch_workers:
+        onnx_session = await asyncio.get_running_loop().run_in_executor(onnx_executor, get_session, model_path)
+        # Another track may have created the worker while this one waited
+        if model_path not in batch_workers:
+            batch_workers[model_path] = BatchInferenceWorker(onnx_session)
+    return batch_workers[model_path]
 
 class DetectionVideoStreamTrack(VideoStreamTrack):
     """
@@ -57,25 +198,75 @@ class DetectionVideoStreamTrack(VideoStreamTrack):
         self.mode = mode
         self.frame_count = 0
         self.last_detection_time = time.time()
+        self._last_metrics_emit = 0
+        self._last_detection_emit = 0
+        self._last_labels = set()
+        self._rng = np.random.default_rng()
+        
+        # Frame skipping state
+        self._infer_inflight = False
+        self._infer_task = None
+        self._last_infer_ts = 0
+        self._ema_infer_latency = 0
+        self.target_period = 1.0 / MAX_DETECTION_FPS
         
         # Load ONNX model for server mode
         if mode == 'server':
+            # Reused for every frame; safe because only one detection is in flight per track
+            self.input_size = (640, 640)
+            self._resize_buf = np.empty((self.input_size[1], self.input_size[0], 3), np.uint8)
+            self._blob = np.empty((3, self.input_size[1], self.input_size[0]), np.float32)
+            # Resize targets keyed by (resized_height, resized_width), one per incoming frame size
+            self._resize_bufs = {}
+            
             model_path = os.path.join(os.path.dirname(__file__), '..', '..', 'webrtc-vlm-frontend', 'public', 'models', 'yolov10n.onnx')
+            # The shared batch worker is fetched on the first detection, off the event loop
+            self.batch_worker = None
             if os.path.exists(model_path):
-                self.onnx_session = ort.InferenceSession(model_path)
+                self.model_path = model_path
             else:
-                self.onnx_session = None
+                self.model_path = None
                 print(f"Warning: ONNX model not found at {model_path}")
 
     async def recv(self):
         frame = await self.track.recv()
         
-        # Convert frame to numpy array for processing
-        img = frame.to_ndarray(format="bgr24")
+        # Start a detection only when the previous one has finished and the cadence allows it;
+        # the frame itself is always returned immediately so outbound pacing never waits on inference
+        now = time.time()
+        if not self._infer_inflight and now - self._last_infer_ts >= self.target_period:
+            # Convert frame to numpy array for processing
+            img = frame.to_ndarray(format="bgr24")
+            
+            self._infer_inflight = True
+            self._last_infer_ts = now
+            self._infer_task = asyncio.create_task(self.process_frame(img, self.frame_count))
+            self._infer_task.add_done_callback(self.on_detection_done)
+        
+        self.frame_count += 1
+        return frame
+
+    def on_detection_done(self, task):
+        self._infer_inflight = False
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Error processing frame: {task.exception()}")
+
+    async def process_frame(self, img, frame_id):
+        """
+        Run detection on one frame, adapt the detection cadence and publish the results
+        """
+        infer_start = time.time()
         
         # Perform object detection
         detections = await self.detect_objects(img)
         
+        infer_latency = time.time() - infer_start
+        if self._ema_infer_latency == 0:
+            self._ema_infer_latency = infer_latency
+        else:
+            self._ema_infer_latency += INFER_LATENCY_ALPHA * (infer_latency - self._ema_infer_latency)
+        self.target_period = max(1.0 / MAX_DETECTION_FPS, INFER_PERIOD_HEADROOM * self._ema_infer_latency)
+        
         # Send detection results via SocketIO
         if detections:
             capture_ts = int(time.time() * 1000)
@@ -83,49 +274,50 @@ class DetectionVideoStreamTrack(VideoStreamTrack):
             inference_ts = recv_ts + 50  # Simulated inference time
             
             detection_result = {
-                "frame_id": str(self.frame_count),
+                "frame_id": str(frame_id),
                 "capture_ts": capture_ts,
                 "recv_ts": recv_ts,
                 "inference_ts": inference_ts,
                 "detections": detections
             }
             
-            socketio.emit('detection_result', detection_result, room=self.session_id)
+            # Send when the detected labels change, otherwise at most every DETECTION_EMIT_INTERVAL
+            now = time.time()
+            labels = {detection['label'] for detection in detections}
+            if labels != self._last_labels or now - self._last_detection_emit >= DETECTION_EMIT_INTERVAL:
+                queue_emit('detection_result', detection_result, self.session_id)
+                self._last_detection_emit = now
+                self._last_labels = labels
             
             # Update metrics
             self.update_metrics(detection_result)
-        
-        self.frame_count += 1
-        return frame
 
     async def detect_objects(self, img):
         """
         Perform object detection on the image
         """
-        if self.mode == 'server' and self.onnx_session:
+        if self.mode == 'server' and self.model_path:
             # Server-side inference using ONNX
-            return self.detect_with_onnx(img)
+            return await self.detect_with_onnx(img)
         else:
             # For WASM mode, we'll send the frame to the client for processing
             # For now, return mock detections
             return self.mock_detections()
 
-    def detect_with_onnx(self, img):
+    async def detect_with_onnx(self, img):
         """
         Perform object detection using ONNX model
         """
         try:
-            # Preprocess image
-            input_size = (640, 640)
-            img_resized = cv2.resize(img, input_size)
-            img_rgb = cv2.cvtColor(img_resized, cv2.COLOR_BGR2RGB)
-            img_normalized = img_rgb.astype(np.float32) / 255.0
-            img_transposed = np.transpose(img_normalized, (2, 0, 1))
-            img_batch = np.expand_dims(img_transposed, axis=0)
+            # Preprocess image into the persistent buffers
+            letterbox(img, self.input_size, dst=self._resize_buf, resize_bufs=self._resize_bufs)
+            # BGR to RGB, HWC to CHW and normalize in a single parallel pass
+            preprocess_kernel(self._resize_buf, self._blob)
             
-            # Run inference
-            input_name = self.onnx_session.get_inputs()[0].name
-            outputs = self.onnx_session.run(None, {input_name: img_batch})
+            # Run inference batched with frames from the other active tracks
+            if self.batch_worker is None:
+                self.batch_worker = await get_batch_worker(self.model_path)
+            outputs = await self.batch_worker.submit(self._blob)
             
             # Post-process outputs (simplified)
             detections = self.postprocess_yolo_outputs(outputs[0])
@@ -142,16 +334,19 @@ class DetectionVideoStreamTrack(VideoStreamTrack):
         detections = []
         # This is a simplified post-processing
         # In a real implementation, you would properly parse YOLO outputs
+        if not MOCK_DETECTIONS:
+            return detections
         
-        # Mock some detections for demonstration
-        if np.random.random() > 0.7:  # 30% chance of detection
+        # Mock some detections for demonstration, drawing all random values in one call
+        r = self._rng.random(6).tolist()
+        if r[0] > 0.7:  # 30% chance of detection
             detections.append({
                 "label": "person",
-                "score": 0.85 + np.random.random() * 0.1,
-                "xmin": 0.2 + np.random.random() * 0.3,
-                "ymin": 0.1 + np.random.random() * 0.3,
-                "xmax": 0.4 + np.random.random() * 0.3,
-                "ymax": 0.6 + np.random.random() * 0.3
+                "score": 0.85 + r[1] * 0.1,
+                "xmin": 0.2 + r[2] * 0.3,
+                "ymin": 0.1 + r[3] * 0.3,
+                "xmax": 0.4 + r[4] * 0.3,
+                "ymax": 0.6 + r[5] * 0.3
             })
         
         return detections
@@ -161,16 +356,19 @@ class DetectionVideoStreamTrack(VideoStreamTrack):
         Generate mock detections for testing
         """
         detections = []
-        if np.random.random() > 0.6:  # 40% chance of detection
-            labels = ["person", "car", "bicycle", "dog", "cat", "bottle", "chair"]
-            label = np.random.choice(labels)
+        if not MOCK_DETECTIONS:
+            return detections
+        
+        r = self._rng.random(7).tolist()
+        if r[0] > 0.6:  # 40% chance of detection
+            label = MOCK_LABELS[int(r[1] * len(MOCK_LABELS))]
             detections.append({
                 "label": label,
-                "score": 0.7 + np.random.random() * 0.25,
-                "xmin": np.random.random() * 0.5,
-                "ymin": np.random.random() * 0.5,
-                "xmax": 0.3 + np.random.random() * 0.4,
-                "ymax": 0.3 + np.random.random() * 0.4
+                "score": 0.7 + r[2] * 0.25,
+                "xmin": r[3] * 0.5,
+                "ymin": r[4] * 0.5,
+                "xmax": 0.3 + r[5] * 0.4,
+                "ymax": 0.3 + r[6] * 0.4
             })
         
         return detections
@@ -182,35 +380,30 @@ class DetectionVideoStreamTrack(VideoStreamTrack):
         session_id = self.session_id
         if session_id not in metrics_data:
             metrics_data[session_id] = {
-                'latencies': [],
-                'inference_times': [],
-                'frame_count': 0,
-                'start_time': time.time()
+                'latency_p50': P2Quantile(0.5),
+                'latency_p95': P2Quantile(0.95),
+                'fps': EmaRate()
             }
+        session_metrics = metrics_data[session_id]
         
         # Calculate latencies
         e2e_latency = time.time() * 1000 - detection_result['capture_ts']
         server_latency = detection_result['inference_ts'] - detection_result['recv_ts']
         network_latency = detection_result['recv_ts'] - detection_result['capture_ts']
         
-        metrics_data[session_id]['latencies'].append(e2e_latency)
-        metrics_data[session_id]['inference_times'].append(server_latency)
-        metrics_data[session_id]['frame_count'] += 1
+        # Streaming median and P95, O(1) per frame with bounded memory
+        session_metrics['latency_p50'].add(e2e_latency)
+        session_metrics['latency_p95'].add(e2e_latency)
+        median_latency = session_metrics['latency_p50'].value
+        p95_latency = session_metrics['latency_p95'].value
         
-        # Emit updated metrics
-        current_time = time.time()
-        elapsed_time = current_time - metrics_data[session_id]['start_time']
-        fps = metrics_data[session_id]['frame_count'] / elapsed_time if elapsed_time > 0 else 0
+        now = time.time()
+        fps = session_metrics['fps'].tick(now)
         
-        # Calculate median and P95 latencies
-        latencies = metrics_data[session_id]['latencies']
-        if latencies:
-            latencies_sorted = sorted(latencies)
-            median_latency = latencies_sorted[len(latencies_sorted) // 2]
-            p95_latency = latencies_sorted[int(len(latencies_sorted) * 0.95)]
-        else:
-            median_latency = 0
-            p95_latency = 0
+        # Coalesce emits to a fixed tick rate; the estimators above still see every frame
+        if now - self._last_metrics_emit < METRICS_EMIT_INTERVAL:
+            return
+        self._last_metrics_emit = now
         
         metrics_update = {
             'modelInferenceTime': server_latency,
@@ -227,36 +420,35 @@ class DetectionVideoStreamTrack(VideoStreamTrack):
             'bandwidth': 1000  # Mock bandwidth
         }
         
-        socketio.emit('metrics_update', metrics_update, room=session_id)
+        queue_emit('metrics_update', metrics_update, session_id)
 
 # SocketIO event handlers
-@socketio.on('connect')
-def handle_connect():
-    print(f'Client connected: {request.sid}')
-    emit('connected', {'status': 'connected'})
-
-@socketio.on('disconnect')
-def handle_disconnect():
-    print(f'Client disconnected: {request.sid}')
+@sio.event
+async def connect(sid, environ):
+    print(f'Client connected: {sid}')
+    await sio.emit('connected', {'status': 'connected'}, to=sid)
+
+@sio.event
+async def disconnect(sid):
+    print(f'Client disconnected: {sid}')
     # Clean up peer connection if exists
-    if request.sid in peer_connections:
-        peer_connections[request.sid].close()
-        del peer_connections[request.sid]
+    if sid in peer_connections:
+        await peer_connections.pop(sid).close()
     
     # Clean up detection session
-    if request.sid in detection_sessions:
-        del detection_sessions[request.sid]
+    if sid in detection_sessions:
+        del detection_sessions[sid]
     
     # Clean up metrics data
-    if request.sid in metrics_data:
-        del metrics_data[request.sid]
+    if sid in metrics_data:
+        del metrics_data[sid]
 
-@socketio.on('join_room')
-def handle_join_room(data):
-    room = data.get('room', request.sid)
-    print(f'Client {request.sid} joining room {room}')
+@sio.on('join_room')
+async def handle_join_room(sid, data):
+    room = data.get('room', sid)
+    print(f'Client {sid} joining room {room}')
     # In a real implementation, you might want to validate the room
-    emit('room_joined', {'room': room})
+    await sio.emit('room_joined', {'room': room}, to=sid)
 
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
@@ -278,6 +470,16 @@ def serve(path):
 def health_check():
     return jsonify({'status': 'healthy', 'timestamp': datetime.now().isoformat()})
 
+async def on_startup():
+    # WebRTC signaling runs its coroutines on the server loop so tracks and emits share it
+    set_signaling_loop(asyncio.get_running_loop())
+    sio.start_background_task(drain_emit_queue)
+
+# Socket.IO handles its own path, everything else goes to the Flask app
+asgi_app = socketio.ASGIApp(sio, other_asgi_app=WsgiToAsgi(app), on_startup=on_startup)
+
 if __name__ == '__main__':
-    socketio.run(app, host='0.0.0.0', port=5000, debug=True)
+    warmup_preprocess()
+    # Serve by import path so routes that import src.main see the same sio and tracks as the server
+    uvicorn.run('src.main:asgi_app', host='0.0.0.0', port=5000, loop='uvloop', http='httptools', workers=1)
 
@@ -1,99 +1,120 @@
-from flask import Blueprint, request, jsonify
-import onnxruntime as ort
+from flask import Blueprint, Response, request
+import orjson
 import numpy as np
 import cv2
 import base64
 import time
 import json
 import os
+from src.utils.onnx_session import get_session, create_io_binding, get_io_names, run_session
+from src.utils.preprocess import letterbox, scale_boxes
 
 inference_bp = Blueprint('inference', __name__)
 
+def ojson(obj):
+    """JSON response via orjson, which serializes numpy values natively"""
+    return Response(orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY), mimetype='application/json')
+
+# Resolve paths from this file so the blueprint works regardless of the working directory
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+MODELS_DIR = os.environ.get('MODELS_DIR', os.path.join(BACKEND_DIR, 'src', 'models'))
+
 # Load YOLO classes
-with open('data/yolo_classes.json', 'r') as f:
+with open(os.path.join(BACKEND_DIR, 'data', 'yolo_classes.json'), 'r') as f:
     yolo_classes = json.load(f)
+class_names = np.asarray(yolo_classes)
 
-# Global model session
-model_session = None
+# Loaded model sessions keyed by model name, kept so switching back doesn't reload
+model_sessions = {}
+model_io_bindings = {}
+model_io_names = {}
 current_model = None
 
 def load_model(model_name):
-    global model_session, current_model
-    if current_model != model_name:
-        model_path = f'models/{model_name}'
-        if os.path.exists(model_path):
-            model_session = ort.InferenceSession(model_path)
-            current_model = model_name
-            return True
-    return model_session is not None
+    global current_model
+    if model_name not in model_sessions:
+        model_path = os.path.join(MODELS_DIR, os.path.basename(model_name))
+        if not os.path.exists(model_path):
+            return False
+        model_session = get_session(model_path)
+        model_sessions[model_name] = model_session
+        model_io_bindings[model_name] = create_io_binding(model_session)
+        model_io_names[model_name] = get_io_names(model_session)
+    current_model = model_name
+    return True
 
 def preprocess_image(image_data, target_size):
-    """Preprocess image for YOLO inference"""
+    """Preprocess base64 data-URL image for YOLO inference"""
     # Decode base64 image
     image_bytes = base64.b64decode(image_data.split('%2C')[1])
+    return preprocess_bytes(image_bytes, target_size)
+
+def preprocess_bytes(image_bytes, target_size):
+    """
+    Preprocess encoded image bytes for YOLO inference.
+    Returns the input tensor and the letterbox (ratio, pad, image_shape) needed to map boxes back,
+    or (None, None) if the bytes can't be decoded as an image
+    """
     nparr = np.frombuffer(image_bytes, np.uint8)
     image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    if image is None:
+        return None, None
     
-    # Convert BGR to RGB
-    image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-    
-    # Resize image
-    resized = cv2.resize(image, target_size)
-    
-    # Normalize and transpose
-    input_tensor = resized.astype(np.float32) / 255.0
-    input_tensor = np.transpose(input_tensor, (2, 0, 1))  # HWC to CHW
-    input_tensor = np.expand_dims(input_tensor, axis=0)  # Add batch dimension
+    # Preserve aspect ratio: resize to fit and pad to the model's fixed input shape
+    padded, r, pad = letterbox(image, target_size)
     
-    return input_tensor
+    # BGR to RGB, normalize and HWC to NCHW in a single OpenCV call; size=(0, 0) skips re-resizing
+    input_tensor = cv2.dnn.blobFromImage(padded, scalefactor=1.0 / 255.0, size=(0, 0), mean=(0, 0, 0), swapRB=True, crop=False)
+    return input_tensor, (r, pad, image.shape)
 
-def postprocess_yolov10(output, conf_threshold=0.25):
+def postprocess_yolov10(output, letterbox_info, conf_threshold=0.25):
     """Postprocess YOLOv10 output"""
-    detections = []
-    
     # YOLOv10 output format: [1, num_detections, 6] where 6 = [x1, y1, x2, y2, score, class_id]
-    for detection in output[0]:
-        x1, y1, x2, y2, score, class_id = detection
-        
-        if score < conf_threshold:
-            break
-            
-        # Convert to normalized coordinates [0, 1]
-        detection_dict = {
-            "label": yolo_classes[int(class_id)],
-            "score": float(score),
-            "xmin": float(x1),
-            "ymin": float(y1),
-            "xmax": float(x2),
-            "ymax": float(y2)
-        }
-        detections.append(detection_dict)
+    detections = output[0]
+    kept = detections[detections[:, 4] >= conf_threshold]
     
-    return detections
+    return build_detections(kept[:, :4], kept[:, 4], kept[:, 5], letterbox_info)
 
-def postprocess_yolov7(output, conf_threshold=0.25):
+def postprocess_yolov7(output, letterbox_info, conf_threshold=0.25):
     """Postprocess YOLOv7 output"""
-    detections = []
-    
     # YOLOv7 output format: [num_detections, 7] where 7 = [batch_id, x1, y1, x2, y2, class_id, score]
-    for detection in output:
-        batch_id, x1, y1, x2, y2, class_id, score = detection
-        
-        if score < conf_threshold:
-            continue
-            
-        # Convert to normalized coordinates [0, 1]
-        detection_dict = {
-            "label": yolo_classes[int(class_id)],
-            "score": float(score),
-            "xmin": float(x1),
-            "ymin": float(y1),
-            "xmax": float(x2),
-            "ymax": float(y2)
+    kept = output[output[:, 6] >= conf_threshold]
+    
+    return build_detections(kept[:, 1:5], kept[:, 6], kept[:, 5], letterbox_info)
+
+def build_detections(boxes, scores, class_ids, letterbox_info):
+    """Convert filtered detection arrays into response dicts"""
+    labels = class_names[class_ids.astype(np.intp)]
+    
+    # Convert from letterboxed input pixels to normalized coordinates [0, 1] of the original image
+    boxes = scale_boxes(boxes, *letterbox_info)
+    
+    # tolist() converts to Python floats in one pass instead of per-value float() casts
+    return [
+        {
+            "label": label,
+            "score": score,
+            "xmin": x1,
+            "ymin": y1,
+            "xmax": x2,
+            "ymax": y2
         }
-        detections.append(detection_dict)
+        for label, score, (x1, y1, x2, y2) in zip(labels.tolist(), scores.tolist(), boxes.tolist())
+    ]
+
+def run_detection(input_tensor, letterbox_info, model_name):
+    """Run inference and postprocessing, returning detections and the inference timestamp"""
+    input_name, output_names = model_io_names[model_name]
+    output = run_session(model_sessions[model_name], input_name, output_names, input_tensor, model_io_bindings[model_name])[0]
+    inference_ts = int(time.time() * 1000)
     
-    return detections
+    # Postprocess based on model type
+    if 'yolov10' in model_name:
+        detections = postprocess_yolov10(output, letterbox_info)
+    else:
+        detections = postprocess_yolov7(output, letterbox_info)
+    
+    return detections, inference_ts
 
 @inference_bp.route('/detect', methods=['POST'])
 def detect_objects():
@@ -111,22 +132,61 @@ def detect_objects():
         
         # Load model if needed
         if not load_model(model_name):
-            return jsonify({'error': 'Failed to load model'}), 500
+            return ojson({'error': 'Failed to load model'}), 500
         
         # Preprocess image
-        input_tensor = preprocess_image(image_data, tuple(resolution))
+        input_tensor, letterbox_info = preprocess_image(image_data, tuple(resolution))
+        if input_tensor is None:
+            return ojson({'error': 'Could not decode image'}), 400
         
         # Run inference
-        inference_start = time.time()
-        input_name = model_session.get_inputs()[0].name
-        output = model_session.run(None, {input_name: input_tensor})[0]
-        inference_ts = int(time.time() * 1000)
+        detections, inference_ts = run_detection(input_tensor, letterbox_info, model_name)
         
-        # Postprocess based on model type
-        if 'yolov10' in model_name:
-            detections = postprocess_yolov10(output)
-        else:
-            detections = postprocess_yolov7(output)
+        # Prepare response
+        response = {
+            "frame_id": frame_id,
+            "capture_ts": capture_ts,
+            "recv_ts": recv_ts,
+            "inference_ts": inference_ts,
+            "detections": detections
+        }
+        
+        return ojson(response)
+        
+    except Exception as e:
+        return ojson({'error': str(e)}), 500
+
+@inference_bp.route('/detect_raw', methods=['POST'])
+def detect_objects_raw():
+    """
+    Detect objects in a JPEG sent as the raw request body.
+    Frame metadata is passed as query parameters, e.g.
+    /detect_raw?frame_id=1&capture_ts=1690000000000&model_name=yolov10n.onnx&width=256&height=256
+    """
+    try:
+        image_bytes = request.get_data(cache=False)
+        if not image_bytes:
+            return ojson({'error': 'No image provided'}), 400
+        
+        # Extract metadata fields
+        frame_id = request.args.get('frame_id')
+        capture_ts = request.args.get('capture_ts', type=int)
+        model_name = request.args.get('model_name', 'yolov10n.onnx')
+        resolution = (request.args.get('width', 256, type=int), request.args.get('height', 256, type=int))
+        
+        recv_ts = int(time.time() * 1000)
+        
+        # Load model if needed
+        if not load_model(model_name):
+            return ojson({'error': 'Failed to load model'}), 500
+        
+        # Preprocess image
+        input_tensor, letterbox_info = preprocess_bytes(image_bytes, resolution)
+        if input_tensor is None:
+            return ojson({'error': 'Could not decode image'}), 400
+        
+        # Run inference
+        detections, inference_ts = run_detection(input_tensor, letterbox_info, model_name)
         
         # Prepare response
         response = {
@@ -137,25 +197,25 @@ def detect_objects():
             "detections": detections
         }
         
-        return jsonify(response)
+        return ojson(response)
         
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return ojson({'error': str(e)}), 500
 
 @inference_bp.route('/models', methods=['GET'])
 def get_available_models():
     """Get list of available models"""
     try:
         models = []
-        if os.path.exists('models'):
-            for file in os.listdir('models'):
+        if os.path.exists(MODELS_DIR):
+            for file in os.listdir(MODELS_DIR):
                 if file.endswith('onnx'):
                     models.append(file)
-        return jsonify({'models': models})
+        return ojson({'models': models})
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return ojson({'error': str(e)}), 500
 
-@inference_bp.route('/health', methods=['GET'])
+@inference_bp.route('/inference/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
-    return jsonify({'status': 'healthy', 'current_model': current_model})
+    return ojson({'status': 'healthy', 'current_model': current_model})
@@ -10,6 +10,21 @@ webrtc_bp = Blueprint('webrtc', __name__)
 peer_connections = {}
 relay = MediaRelay()
 
+# Single long-lived loop that owns every peer connection and its tracks.
+# Set to the ASGI server's loop on startup; Flask views run in a worker thread and submit to it.
+BG_LOOP = None
+SIGNALING_TIMEOUT = 10
+
+def set_signaling_loop(loop):
+    global BG_LOOP
+    BG_LOOP = loop
+
+def run_on_bg_loop(coro):
+    """
+    Run a coroutine on the aiortc loop and wait for its result
+    """
+    return asyncio.run_coroutine_threadsafe(coro, BG_LOOP).result(timeout=SIGNALING_TIMEOUT)
+
 @webrtc_bp.route('/offer', methods=['POST'])
 def handle_offer():
     """
@@ -24,36 +39,33 @@ def handle_offer():
         if not offer:
             return jsonify({'error': 'No offer provided'}), 400
         
-        # Create peer connection
-        pc = RTCPeerConnection()
-        peer_connections[session_id] = pc
-        
-        # Handle incoming track
-        @pc.on("track")
-        async def on_track(track):
-            print(f"Received track: {track.kind}")
-            if track.kind == "video":
-                # Import here to avoid circular imports
-                from src.main import DetectionVideoStreamTrack
-                
-                # Create detection track
-                detection_track = DetectionVideoStreamTrack(track, session_id, mode)
-                
-                # Add track to peer connection
-                pc.addTrack(detection_track)
-        
-        @pc.on("connectionstatechange")
-        async def on_connectionstatechange():
-            print(f"Connection state is {pc.connectionState}")
-            if pc.connectionState == "closed":
-                if session_id in peer_connections:
-                    del peer_connections[session_id]
-        
-        # Set remote description
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        
         async def process_offer():
+            # Create the peer connection on the aiortc loop so its callbacks run there
+            pc = RTCPeerConnection()
+            peer_connections[session_id] = pc
+            
+            # Handle incoming track
+            @pc.on("track")
+            async def on_track(track):
+                print(f"Received track: {track.kind}")
+                if track.kind == "video":
+                    # Import here to avoid circular imports
+                    from src.main import DetectionVideoStreamTrack
+                    
+                    # Create detection track
+                    detection_track = DetectionVideoStreamTrack(track, session_id, mode)
+                    
+                    # Add track to peer connection
+                    pc.addTrack(detection_track)
+            
+            @pc.on("connectionstatechange")
+            async def on_connectionstatechange():
+                print(f"Connection state is {pc.connectionState}")
+                if pc.connectionState == "closed":
+                    if session_id in peer_connections:
+                        del peer_connections[session_id]
+            
+            # Set remote description
             await pc.setRemoteDescription(RTCSessionDescription(
                 sdp=offer['sdp'],
                 type=offer['type']
@@ -68,7 +80,7 @@ def handle_offer():
                 'type': pc.localDescription.type
             }
         
-        answer = loop.run_until_complete(process_offer())
+        answer = run_on_bg_loop(process_offer())
         
         return jsonify({
             'answer': answer,
@@ -95,14 +107,11 @@ def handle_ice_candidate():
         pc = peer_connections[session_id]
         
         # Add ICE candidate
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        
         async def add_candidate():
             if candidate:
                 await pc.addIceCandidate(candidate)
         
-        loop.run_until_complete(add_candidate())
+        run_on_bg_loop(add_candidate())
         
         return jsonify({'status': 'success'})
         
@@ -122,14 +131,11 @@ def handle_close():
         if session_id in peer_connections:
             pc = peer_connections[session_id]
             
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            
             async def close_connection():
                 await pc.close()
             
-            loop.run_until_complete(close_connection())
-            del peer_connections[session_id]
+            run_on_bg_loop(close_connection())
+            peer_connections.pop(session_id, None)
         
         return jsonify({'status': 'closed'})
         
@@ -0,0 +1,10 @@
+import orjson
+
+# Drop-in for the stdlib json module used by Socket.IO packet encoding.
+# Socket.IO passes stdlib keyword arguments (e.g. separators) that orjson doesn't need.
+
+def dumps(obj, **kwargs):
+    return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+
+def loads(s, **kwargs):
+    return orjson.loads(s)
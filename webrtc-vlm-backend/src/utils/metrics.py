@@ -0,0 +1,90 @@
+import bisect
+
+class P2Quantile:
+    """
+    Streaming quantile estimate using the P² algorithm (Jain & Chlamtac):
+    five markers of state and O(1) work per sample, no stored history
+    """
+    def __init__(self, q):
+        self.q = q
+        self.heights = []
+        self.positions = [0, 1, 2, 3, 4]
+        self.desired = [0, 2 * q, 4 * q, 2 + 2 * q, 4]
+        self.increments = [0, q / 2, q, (1 + q) / 2, 1]
+
+    def add(self, x):
+        h = self.heights
+        if len(h) < 5:
+            bisect.insort(h, x)
+            return
+        
+        # Find the cell the sample falls in, extending the extremes if needed
+        if x < h[0]:
+            h[0] = x
+            k = 0
+        elif x >= h[4]:
+            h[4] = x
+            k = 3
+        else:
+            k = bisect.bisect_right(h, x) - 1
+        
+        for i in range(k + 1, 5):
+            self.positions[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+        
+        # Nudge the middle markers towards their desired positions
+        n = self.positions
+        for i in (1, 2, 3):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                height = self.parabolic(i, d)
+                if not h[i - 1] < height < h[i + 1]:
+                    height = self.linear(i, d)
+                h[i] = height
+                n[i] += d
+
+    def parabolic(self, i, d):
+        n, h = self.positions, self.heights
+        return h[i] + d / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + d) * (h[i + 1] - h[i]) / (n[i + 1] - n[i])
+            + (n[i + 1] - n[i] - d) * (h[i] - h[i - 1]) / (n[i] - n[i - 1])
+        )
+
+    def linear(self, i, d):
+        n, h = self.positions, self.heights
+        return h[i] + d * (h[i + d] - h[i]) / (n[i + d] - n[i])
+
+    @property
+    def value(self):
+        h = self.heights
+        if not h:
+            return 0
+        if len(h) < 5:
+            # Too few samples for the markers, use the exact order statistic
+            return h[int(len(h) * self.q)]
+        return h[2]
+
+class EmaRate:
+    """
+    Event rate (events per second) from an exponential moving average of the interval between events.
+    Averaging intervals rather than per-interval rates keeps irregular ticks from inflating the estimate
+    """
+    def __init__(self, alpha=0.1):
+        self.alpha = alpha
+        self.last_time = None
+        self.ema_dt = None
+
+    def tick(self, now):
+        if self.last_time is not None and now > self.last_time:
+            dt = now - self.last_time
+            self.ema_dt = dt if self.ema_dt is None else self.alpha * dt + (1 - self.alpha) * self.ema_dt
+        self.last_time = now
+        return self.value
+
+    @property
+    def value(self):
+        if not self.ema_dt:
+            return 0
+        return 1.0 / self.ema_dt
@@ -0,0 +1,132 @@
+import os
+import hashlib
+import platform
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import onnxruntime as ort
+
+CUDA_PROVIDER = ('CUDAExecutionProvider', {'device_id': 0, 'cudnn_conv_algo_search': 'HEURISTIC'})
+
+# Thread that runs session.run off the event loop; ORT releases the GIL while it runs.
+# Batches are awaited one at a time, so a single thread suffices and each run gets every core
+onnx_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='onnx')
+
+# Optimized CPU graphs are cached here (git-ignored) between runs
+ORT_CACHE_DIR = os.environ.get(
+    'ORT_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), '.ort_cache')
+)
+
+# One session per model file for the whole process, shared by every caller
+_ONNX_SESSIONS = {}
+# Sessions are requested from both the WSGI thread and the event loop
+_ONNX_SESSIONS_LOCK = threading.Lock()
+
+def create_session_options(use_cuda=False):
+    """
+    Graph optimization and threading settings shared by every session
+    """
+    sess_options = ort.SessionOptions()
+    # Full fusion is a win on CPU but has regressed on CUDA, so GPU sessions keep the basic level
+    if use_cuda:
+        sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_BASIC
+    else:
+        sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    
+    sess_options.intra_op_num_threads = os.cpu_count() or 1
+    sess_options.inter_op_num_threads = 1
+    sess_options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    sess_options.add_session_config_entry('session.intra_op.allow_spinning', '0')
+    return sess_options
+
+def optimized_model_path(model_path):
+    """
+    Path where the CPU-optimized graph is cached between runs.
+    ORT_ENABLE_ALL bakes in layout changes tuned to this CPU, so the cache key includes
+    the source model, the ORT version and the host; a graph from anywhere else is never reused
+    """
+    key = '|'.join([os.path.realpath(model_path), ort.__version__, platform.node(), platform.machine()])
+    digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+    name = os.path.splitext(os.path.basename(model_path))[0]
+    return os.path.join(ORT_CACHE_DIR, f"{name}-{digest}.onnx")
+
+def int8_model_path(model_path):
+    """
+    Path of the INT8 variant produced by scripts/quantize_model.py
+    """
+    root, ext = os.path.splitext(model_path)
+    return f"{root}_int8{ext}"
+
+def resolve_model_path(model_path):
+    """
+    Prefer the quantized INT8 model when one has been generated
+    """
+    quantized_path = int8_model_path(model_path)
+    if os.path.exists(quantized_path):
+        return quantized_path
+    return model_path
+
+def create_session(model_path):
+    """
+    Create an ONNX session, preferring the CUDA execution provider when it is available
+    """
+    use_cuda = 'CUDAExecutionProvider' in ort.get_available_providers()
+    providers = ['CPUExecutionProvider']
+    if use_cuda:
+        providers.insert(0, CUDA_PROVIDER)
+    sess_options = create_session_options(use_cuda)
+    
+    if not use_cuda:
+        cached_path = optimized_model_path(model_path)
+        if os.path.exists(cached_path) and os.path.getmtime(cached_path) >= os.path.getmtime(model_path):
+            # Already optimized on a previous run, skip the re-optimize step
+            model_path = cached_path
+            sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+        else:
+            try:
+                os.makedirs(ORT_CACHE_DIR, exist_ok=True)
+            except OSError:
+                pass
+            if os.access(ORT_CACHE_DIR, os.W_OK):
+                sess_options.optimized_model_filepath = cached_path
+    
+    return ort.InferenceSession(model_path, sess_options, providers=providers)
+
+def get_session(model_path):
+    """
+    Return the shared session for a model, creating it on first use
+    """
+    # Key by the file actually loaded, so a model and its _int8 variant share one session
+    key = os.path.realpath(resolve_model_path(model_path))
+    with _ONNX_SESSIONS_LOCK:
+        if key not in _ONNX_SESSIONS:
+            _ONNX_SESSIONS[key] = create_session(key)
+        return _ONNX_SESSIONS[key]
+
+def create_io_binding(session):
+    """
+    Return a reusable IOBinding if the session runs on CUDA, otherwise None
+    """
+    if 'CUDAExecutionProvider' in session.get_providers():
+        return session.io_binding()
+    return None
+
+def get_io_names(session):
+    """
+    Input name and output names of a session, looked up once instead of per frame
+    """
+    return session.get_inputs()[0].name, [output.name for output in session.get_outputs()]
+
+def run_session(session, input_name, output_names, input_tensor, io_binding=None):
+    """
+    Run inference, copying the input to the GPU once and binding outputs on device when possible
+    """
+    if io_binding is None:
+        return session.run(output_names, {input_name: input_tensor})
+    
+    input_value = ort.OrtValue.ortvalue_from_numpy(input_tensor, 'cuda', 0)
+    io_binding.bind_ortvalue_input(input_name, input_value)
+    for output_name in output_names:
+        io_binding.bind_output(output_name, 'cuda')
+    session.run_with_iobinding(io_binding)
+    return io_binding.copy_outputs_to_cpu()